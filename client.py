@@ -1,14 +1,24 @@
 import os
 import re
 import sys
+import asyncio
 from openai import OpenAI
 from mcp.client.stdio import stdio_client
-from mcp import ClientSession,StdioServerParameters
+from mcp.client.sse import sse_client
+from mcp.client.streamable_http import streamablehttp_client
+from mcp import ClientSession,StdioServerParameters,types
+from mcp.shared.exceptions import McpError
 from contextlib import AsyncExitStack
 from datetime import datetime
-from typing import Optional
+from typing import Callable, Optional, Union
 from dotenv import load_dotenv
+from model_router import get_router
+from server_pool import ServerPool, server_urls_from_env
+from response_templates import fast_path_enabled, render_fast_response
+from plan_prompt import build_legacy_prompt, build_plan_prompt
+from rate_limiter import estimate_tokens
 import json
+import httpx
 import logging
 
 # 配置日志
@@ -24,6 +34,14 @@ logger = logging.getLogger("client")
 
 load_dotenv()
 
+# 请求读超时（服务器无响应）和连接关闭时会话返回的错误码，视为当前服务器不可用
+DEAD_SERVER_CODES = (httpx.codes.REQUEST_TIMEOUT, types.CONNECTION_CLOSED)
+
+
+class ServerUnavailableError(RuntimeError):
+    """当前MCP服务器的连接已断开或无响应"""
+
+
 class MCPClient:
 
     def __init__(self):
@@ -39,10 +57,36 @@ class MCPClient:
                     base_url = self.base_url,
                     api_key = self.api_key,
                     timeout=60)  # 增加超时值到60秒
+        # 规划、情感分析和总结按调用点路由到不同模型端点
+        self.router = get_router()
         self.session: Optional[ClientSession] = None
+        # HTTP传输时的服务器池和当前连接的URL；每个连接在独立的任务中持有传输层和会话上下文，
+        # _conn_stop通知该任务关闭连接，_conn_dead在传输层出错时置位
+        self.server_pool: Optional[ServerPool] = None
+        self.server_url: Optional[str] = None
+        self._conn_task: Optional[asyncio.Task] = None
+        self._conn_stop: Optional[asyncio.Event] = None
+        self._conn_dead = asyncio.Event()
+        self._conn_error: Optional[BaseException] = None
+        # 会话内缓存的工具列表和规划系统提示，收到工具列表变更通知时失效
+        self._tools: Optional[list] = None
+        self._plan_prompt: Optional[str] = None
+        self._legacy_prompt_tokens = 0
         
         
-    async def connect_to_server(self,server_script_path:str):
+    async def connect_to_server(self,server: Union[str, list]):
+        """连接MCP服务器
+
+        server为.py/.js脚本路径时以stdio方式启动子进程；
+        为http(s) URL或URL列表时通过streamable-HTTP/SSE连接服务器池，支持负载均衡和故障转移。
+        """
+        if isinstance(server, list) or server.startswith(("http://", "https://")):
+            urls = server if isinstance(server, list) else [server]
+            self.server_pool = ServerPool(urls)
+            await self._connect_pool()
+            return
+
+        server_script_path = server
         #判断脚本类型
         is_py = server_script_path.endswith('.py')
         is_js = server_script_path.endswith('.js')
@@ -68,11 +112,120 @@ class MCPClient:
             stdio_client(server_params))
         #拆包通信，读取服务端返回数据
         self.stdio,self.write = stdio_transport
-        
+        await self._start_session(self.exit_stack, self.stdio, self.write)
+
+    async def _connect_pool(self):
+        """按服务器池顺序依次尝试连接，直到成功"""
+        last_error = None
+        for url in self.server_pool.order():
+            ready = asyncio.get_running_loop().create_future()
+            stop = asyncio.Event()
+            self._conn_dead = asyncio.Event()
+            self._conn_error = None
+            task = asyncio.create_task(self._run_connection(url, ready, stop, self._conn_dead))
+            try:
+                await ready
+            except asyncio.CancelledError:
+                task.cancel()
+                raise
+            except Exception as e:
+                logger.error(f"Failed to connect to MCP server {url}: {e}")
+                self.server_pool.mark_failed(url)
+                self.session = None
+                await task
+                last_error = e
+                continue
+            self.server_pool.mark_ok(url)
+            self._conn_task, self._conn_stop = task, stop
+            self.server_url = url
+            logger.info(f"Connected to MCP server {url}")
+            return
+        raise RuntimeError(f"All MCP servers are unavailable: {last_error}")
+
+    async def _run_connection(self, url: str, ready: asyncio.Future, stop: asyncio.Event, dead: asyncio.Event):
+        """在独立的长生命周期任务中建立并持有一个服务器连接，直到stop置位
+
+        传输层内部的anyio cancel scope必须在进入它的同一任务中退出，
+        所以连接的建立和关闭都在这个任务里完成；传输层出错导致上下文退出时把dead置位。
+        """
+        try:
+            async with AsyncExitStack() as stack:
+                # 以/sse结尾的地址使用SSE传输，其余使用streamable-HTTP
+                if url.rstrip("/").endswith("/sse"):
+                    read, write = await stack.enter_async_context(sse_client(url))
+                else:
+                    read, write, _ = await stack.enter_async_context(streamablehttp_client(url))
+                await self._start_session(stack, read, write)
+                ready.set_result(None)
+                await stop.wait()
+        except Exception as e:
+            if not ready.done():
+                ready.set_exception(e)
+            elif stop.is_set():
+                logger.warning(f"Error closing connection to {url}: {e}")
+            else:
+                logger.error(f"Connection to MCP server {url} lost: {e}")
+                self._conn_error = e
+                dead.set()
+
+    async def _close_connection(self):
+        """通知连接任务关闭连接并等待其退出"""
+        self.session = None
+        if self._conn_task:
+            self._conn_stop.set()
+            await self._conn_task
+            self._conn_task = self._conn_stop = None
+
+    async def _failover(self):
+        """当前服务器不可用时关闭连接并切换到池中的下一个服务器"""
+        self.server_pool.mark_failed(self.server_url)
+        await self._close_connection()
+        await self._connect_pool()
+
+    async def _call_session(self, operation):
+        """执行会话操作；连接断开或请求读超时时抛出ServerUnavailableError，而不是一直等待"""
+        op = asyncio.ensure_future(operation(self.session))
+        dead = asyncio.ensure_future(self._conn_dead.wait())
+        try:
+            await asyncio.wait({op, dead}, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            dead.cancel()
+            if not op.done():
+                op.cancel()
+                await asyncio.gather(op, return_exceptions=True)
+        if op.cancelled():
+            raise ServerUnavailableError(f"MCP server {self.server_url} connection lost: {self._conn_error}")
+        try:
+            return op.result()
+        except McpError as e:
+            if e.error.code in DEAD_SERVER_CODES:
+                raise ServerUnavailableError(f"MCP server {self.server_url} not responding: {e}") from e
+            raise
+
+    async def _with_failover(self, operation, replay: bool = True):
+        """执行会话操作；当前服务器断开或无响应时切换到池中的下一个服务器
 
+        连接已知断开时先切换再执行；执行中断开或读超时时切换服务器，
+        replay为False时（如call_tool）切换后不重发请求，避免非幂等工具被重复执行。
+        """
+        if self.server_pool and self._conn_dead.is_set():
+            logger.warning(f"MCP server {self.server_url} connection lost, failing over: {self._conn_error}")
+            await self._failover()
+        try:
+            return await self._call_session(operation)
+        except ServerUnavailableError as e:
+            if not self.server_pool:
+                raise
+            logger.warning(f"{e}, failing over")
+            await self._failover()
+            if not replay:
+                raise
+            return await self._call_session(operation)
+
+    async def _start_session(self, stack: AsyncExitStack, read, write):
         #创建MCP客户端会话对象
-        self.session = await self.exit_stack.enter_async_context(
-            ClientSession(self.stdio, self.write, self.client)
+        self.session = await stack.enter_async_context(
+            ClientSession(read, write, self.client, message_handler=self._handle_message)
         )
         
         # 尝试设置会话超时（如果支持）
@@ -83,30 +236,67 @@ class MCPClient:
         #初始化会话
         await self.session.initialize()
 
-        #获取工具列表并打印
+        #获取工具列表并打印（直接使用新会话，连接阶段的失败由调用方处理，不走故障转移）
         response = await self.session.list_tools()
-        tools = response.tools
+        self._set_tools(response.tools)
+        tools = self._tools
         print("Connect to the server successfully. Available tools:", [tool.name for tool in tools])
 
-    async def process_query(self,query:str) -> str:
+    async def _handle_message(self, message):
+        """处理服务端通知和传输层异常
+
+        工具列表变更时让缓存失效，下次查询时重新获取；
+        传输层推送到读流中的网络异常说明服务器已不可达，标记连接断开，下一次会话操作会故障转移。
+        """
+        if isinstance(message, httpx.TransportError):
+            logger.error(f"Transport error from MCP server {self.server_url}: {message}")
+            self._conn_error = message
+            self._conn_dead.set()
+        elif isinstance(message, Exception):
+            logger.warning(f"Error from MCP server {self.server_url}: {message}")
+        elif isinstance(message, types.ServerNotification) and isinstance(message.root, types.ToolListChangedNotification):
+            logger.info("收到工具列表变更通知，刷新工具缓存")
+            self._set_tools(None)
+
+    def _set_tools(self, tools: Optional[list]):
+        self._tools = tools
+        if tools is None:
+            self._plan_prompt = None
+            return
+        # 规划提示只在工具列表变化时重建，保证同一会话内的提示前缀逐字节相同
+        self._plan_prompt = build_plan_prompt(tools)
+        self._legacy_prompt_tokens = estimate_tokens(build_legacy_prompt(tools))
+        logger.debug(f"规划系统提示：\n{self._plan_prompt}")
+
+    async def _get_tools(self) -> list:
+        """返回会话内缓存的工具列表，缓存失效时才向服务器请求"""
+        if self._tools is None:
+            response = await self._with_failover(lambda session: session.list_tools())
+            self._set_tools(response.tools)
+        return self._tools
+
+    async def process_query(self,query:str, on_token: Optional[Callable[[str], None]] = None,
+                            on_event: Optional[Callable[[str, dict], None]] = None) -> str:
+        """处理用户查询
+
+        传入on_token时，需要LLM总结的回复会逐段流式回调；
+        传入on_event时，按进度回调 status / plan_ready / tool_start / tool_end / token / final 事件，
+        final事件附带本次规划调用的输入token统计（plan_usage）。
+        """
         if not self.session:
             raise RuntimeError("Client session is not initialized. Please connect to the server first.")
+
+        def emit(event: str, data: dict):
+            if on_event:
+                on_event(event, data)
+
+        if on_event and not on_token:
+            on_token = lambda delta: emit("token", {"text": delta})
+        emit("status", {"message": "正在规划工具调用..."})
         
         #发送查询到MCP服务器
         messages = [{"role": "user", "content": query}]
-        response = await self.session.list_tools()
-        
-        #处理工具列表
-        available_tools = [
-            {
-                "type": "function",
-                "function": {
-                    "name": tool.name,
-                    "description": tool.description,
-                    "input_schema": tool.inputSchema
-                } 
-            } for tool in response.tools
-        ]
+        available_tools = await self._get_tools()
 
         #提取问题关键词
         keyword_match = re.search(r"(关于|分析|查询|搜索|查看)([^的、s. 。 、 ? \n]+)", query)
@@ -120,8 +310,10 @@ class MCPClient:
         query = query.strip() + f"[md_filename={md_filename}][md_path={md_path}]"
         messages = [{"role": "user", "content": query}]
 
-        tool_plan = await self.plan_tool_usage(query, available_tools)
+        tool_plan, plan_usage = await self.plan_tool_usage(query, available_tools)
+        emit("plan_ready", {"plan": tool_plan})
         tool_outputs = {}
+        failed_tools = set()
         messages = [{"role": "user", "content": query}]
 
         #执行工具调用
@@ -139,24 +331,31 @@ class MCPClient:
             if tool_name == "send_email_with_attachment" and "attachment_path" not in tool_args:
                 tool_args["attachment_path"] = md_path
 
-            result = await self.session.call_tool(
-                tool_name=tool_name,
-                tool_args=tool_args
-            )
+            emit("tool_start", {"name": tool_name, "arguments": tool_args})
+            result = await self._with_failover(lambda session: session.call_tool(
+                name=tool_name,
+                arguments=tool_args
+            ), replay=False)
 
             tool_outputs[tool_name] = result.content[0].text
+            if getattr(result, "isError", False):
+                failed_tools.add(tool_name)
+            emit("tool_end", {"name": tool_name, "result": result.content[0].text})
             messages.append({
                 "role": "tool",
                 "tool_call_id": tool_name,
                 "content": f"Tool {tool_name} executed with result: {result.content[0].text}"
             })
 
-        #生成最终回答
-        final_response = self.client.chat.completions.create(
-            model=self.model,
-            messages=messages
-        )
-        final_output = final_response.choices[0].message.content
+        #生成最终回答：已知计划形态直接用模板渲染，开放式查询才调用LLM总结
+        final_output = render_fast_response(tool_plan, tool_outputs, failed_tools) if fast_path_enabled() else None
+        if final_output is not None:
+            logger.info("命中模板快速回复，跳过总结LLM调用")
+        elif on_token:
+            final_output = await asyncio.to_thread(self._stream_summary, messages, on_token)
+        else:
+            final_response = await asyncio.to_thread(self.router.chat, "summary", messages)
+            final_output = final_response.choices[0].message.content
 
 
         #文本清理为合法文件名
@@ -179,8 +378,17 @@ class MCPClient:
             f.write(f"模型回复：\n{final_output}\n")
         print(f"Output saved to {output_path}")
 
+        emit("final", {"response": final_output, "output_path": output_path, "plan_usage": plan_usage})
         return final_output
     
+    def _stream_summary(self, messages: list, on_token: Callable[[str], None]) -> str:
+        """在工作线程中消费流式总结，逐段回调on_token"""
+        chunks = []
+        for delta in self.router.chat_stream("summary", messages):
+            chunks.append(delta)
+            on_token(delta)
+        return "".join(chunks)
+
     async def chat_loop(self):
         print("欢迎使用MCP客户端！输入'退出'或'quit'结束对话。")
 
@@ -195,37 +403,33 @@ class MCPClient:
             except Exception as e:
                 print(f"发生错误：{e}")
 
-    async def plan_tool_usage(self, query: str, available_tools: list) -> list:
+    async def plan_tool_usage(self, query: str, available_tools: list) -> tuple:
+        """生成工具调用计划，返回(工具计划, 规划调用的输入token统计)"""
         if not self.session:
             raise RuntimeError("Client session is not initialized. Please connect to the server first.")
         
-        #调用MCP服务器的plan_tool_usage方法
-        print("\n 提交给大模型的工具定义：")
-        print(json.dumps(available_tools, indent=2, ensure_ascii=False))
-        tool_list_text = "\n".join(
-            [f"{tool['function']['name']}: {tool['function']['description']}" for tool in available_tools]
-        )
-        system_prompt = {
-            "role": "system",
-            "content": ("你是一个智能助手，用户会给出一句请求。以下是可用的工具列表（请严格使用工具名称）：\n"
-                        f"{tool_list_text}\n"
-                        "请根据用户的查询计划使用这些工具。"
-                        "如果多个工具需要串联，后续步骤中可以使用{{上一步工具名}}占位。\n"
-                        "返回格式：JSON数组，每个对象包含name和arguments字段"
-                        )
-        }
+        #系统提示使用紧凑的工具描述，且不再额外传入tools参数（tool_choice为none时模型不会直接调用工具）
+        #会话缓存的工具列表直接复用已构建的提示，保证提示前缀逐字节相同；缓存只由_get_tools和通知处理维护
+        if available_tools is self._tools:
+            plan_prompt, legacy_tokens = self._plan_prompt, self._legacy_prompt_tokens
+        else:
+            plan_prompt = build_plan_prompt(available_tools)
+            legacy_tokens = estimate_tokens(build_legacy_prompt(available_tools))
+        system_prompt = {"role": "system", "content": plan_prompt}
         
         #构造消息列表，将系统提示和用户query一起作为消息输入
         messages = [system_prompt, {"role": "user", "content": query}]
         # 为工具使用计划调用添加显式超时设置
         logger.info("开始计划工具使用，设置超时60秒")
-        response = self.client.chat.completions.create(
-            model=self.model,
-            messages=messages,
-            tools=available_tools,
-            tool_choice="none",  # 不直接调用工具，先获取计划
+        # 路由器的LLM调用和限流等待都是阻塞的，放到线程中执行，避免卡住共享的事件循环
+        response = await asyncio.to_thread(
+            self.router.chat,
+            "plan",
+            messages,
+            input_text=query,
             timeout=60  # 显式设置超时为60秒
         )
+        plan_usage = self._report_plan_usage(response, query, plan_prompt, legacy_tokens)
         logger.info("工具使用计划获取成功")
 
         #提取模型返回的json
@@ -240,13 +444,37 @@ class MCPClient:
         try:
             tool_plan = json.loads(json_str)
             logger.info(f"成功解析工具计划: {tool_plan}")
-            return tool_plan if isinstance(tool_plan, list) else []
+            return (tool_plan if isinstance(tool_plan, list) else []), plan_usage
         except Exception as e:
             logger.error(f"解析工具计划失败: {e}")
             print(f"failed to parse tool plan: {e}")
-            return []
+            return [], plan_usage
         
+    def _report_plan_usage(self, response, query: str, plan_prompt: str, legacy_prompt_tokens: int) -> dict:
+        """统计规划调用的输入token
+
+        节省量只在同一估算口径下比较（旧格式估算 vs 新格式估算），
+        服务商返回的实际用量和提示缓存命中量单独列出。
+        """
+        legacy = legacy_prompt_tokens + estimate_tokens(query)
+        compact = estimate_tokens(plan_prompt) + estimate_tokens(query)
+        usage = getattr(response, "usage", None)
+        details = getattr(usage, "prompt_tokens_details", None)
+        plan_usage = {
+            "prompt_tokens": getattr(usage, "prompt_tokens", None),
+            "cached_tokens": getattr(details, "cached_tokens", None),
+            "estimated_tokens": compact,
+            "legacy_estimated_tokens": legacy,
+            "estimated_saved_tokens": legacy - compact,
+            "estimated_saved_ratio": round((legacy - compact) / legacy, 3) if legacy else 0.0,
+        }
+        logger.info(f"规划输入token：实际 {plan_usage['prompt_tokens']}，提示缓存命中 {plan_usage['cached_tokens']}；"
+                    f"估算 {compact}（旧格式估算 {legacy}，减少 {legacy - compact}，"
+                    f"{plan_usage['estimated_saved_ratio']:.0%}）")
+        return plan_usage
+
     async def cleanup(self):
+        await self._close_connection()
         await self.exit_stack.aclose()
 
 
@@ -264,10 +492,11 @@ async def main():
             return
 
         client = MCPClient()
-        server_script_path = os.path.join("server.py") # 替换为实际的服务器脚本路径
+        # 配置了MCP_SERVER_URLS时连接HTTP服务器池，否则以stdio方式启动本地server.py
+        server = server_urls_from_env() or os.path.join("server.py") # 替换为实际的服务器脚本路径
         logger.info("connect to server 即将执行")
         try:
-            await client.connect_to_server(server_script_path)
+            await client.connect_to_server(server)
             await client.chat_loop()
         except Exception as e:
             logger.error(f"发生错误：{e}", exc_info=True)
@@ -281,7 +510,6 @@ async def main():
             await client.cleanup()
 
 if __name__ == "__main__":
-    import asyncio
     try:
         asyncio.run(main())
     except Exception as e:
@@ -1,11 +1,19 @@
 import os
+import re
+import json
+import queue
 import asyncio
 import threading
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash
+import time
+import uuid
+from flask import Flask, Response, render_template, request, jsonify, redirect, url_for, flash
 from werkzeug.utils import secure_filename
 from datetime import datetime
 import logging
 from client import MCPClient  # 导入客户端类
+from ingest import INGEST_EXTENSIONS, ingest_file
+from server_pool import server_urls_from_env
+from rate_limiter import get_limiter
 
 # 配置日志
 logging.basicConfig(
@@ -28,7 +36,7 @@ app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB上限
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
 # 允许的文件扩展名
-ALLOWED_EXTENSIONS = {'txt', 'md', 'png', 'jpg', 'jpeg'}
+ALLOWED_EXTENSIONS = {'txt', 'md', 'png', 'jpg', 'jpeg', 'csv', 'jsonl'}
 
 # 检查文件扩展名是否允许
 def allowed_file(filename):
@@ -62,6 +70,71 @@ task_runner = AsyncTaskRunner()
 def run_async_task(coroutine):
     return task_runner.run_task(coroutine)
 
+# 后台评论文件分析任务的状态以JSON文件保存，多个gunicorn worker都能查询到同一任务的进度
+INGEST_JOB_DIR = './ingest_results/jobs'
+INGEST_JOB_TTL = 3600  # 已结束任务的保留时间（秒），过期后清理
+
+def ingest_job_path(job_id):
+    return os.path.join(INGEST_JOB_DIR, f"{job_id}.json")
+
+def save_ingest_job(job_id, job):
+    os.makedirs(INGEST_JOB_DIR, exist_ok=True)
+    path = ingest_job_path(job_id)
+    # 写入唯一的临时文件后原子替换，查询方不会读到半截内容
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(job, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def load_ingest_job(job_id):
+    # job_id来自URL，只接受uuid4的hex格式，防止路径穿越
+    if not re.fullmatch(r'[0-9a-f]{32}', job_id):
+        return None
+    try:
+        with open(ingest_job_path(job_id), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def prune_ingest_jobs():
+    if not os.path.isdir(INGEST_JOB_DIR):
+        return
+    now = time.time()
+    for filename in os.listdir(INGEST_JOB_DIR):
+        path = os.path.join(INGEST_JOB_DIR, filename)
+        try:
+            if now - os.path.getmtime(path) > INGEST_JOB_TTL:
+                os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def start_ingest_job(filepath):
+    prune_ingest_jobs()
+    job_id = uuid.uuid4().hex
+    job = {'status': 'running', 'file_path': filepath, 'progress': {}}
+    save_ingest_job(job_id, job)
+
+    def on_progress(progress):
+        job['progress'] = progress
+        save_ingest_job(job_id, job)
+
+    def on_done(future):
+        if future.cancelled():
+            logger.warning(f"Ingest job {job_id} cancelled")
+            job.update(status='failed', error='任务已取消')
+        elif future.exception():
+            logger.error(f"Ingest job {job_id} failed: {future.exception()}")
+            job.update(status='failed', error=str(future.exception()))
+        else:
+            job.update(status='done', progress=future.result())
+        save_ingest_job(job_id, job)
+
+    # 不等待结果，直接在后台事件循环中运行
+    future = asyncio.run_coroutine_threadsafe(
+        ingest_file(filepath, on_progress=on_progress, job_id=job_id), task_runner.loop)
+    future.add_done_callback(on_done)
+    return job_id
+
 # 创建MCP客户端实例
 mcp_client = None
 
@@ -70,8 +143,9 @@ def init_mcp_client():
     if mcp_client is None:
         mcp_client = MCPClient()
         try:
-            server_script_path = os.path.join("server.py")
-            run_async_task(mcp_client.connect_to_server(server_script_path))
+            # 多worker部署时通过MCP_SERVER_URLS共享独立扩缩容的MCP服务器池
+            server = server_urls_from_env() or os.path.join("server.py")
+            run_async_task(mcp_client.connect_to_server(server))
             logger.info("MCP client initialized successfully")
         except Exception as e:
             logger.error(f"Failed to initialize MCP client: {str(e)}")
@@ -103,6 +177,52 @@ def process_query():
             logger.error(f"Error processing query: {str(e)}")
             return jsonify({'success': False, 'error': str(e)})
 
+# 格式化一条SSE事件
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.route('/query_stream')
+def query_stream():
+    query = request.args.get('query', '')
+
+    def generate():
+        # 浏览器以事件流读取该接口，参数错误也要以SSE事件返回
+        if not query:
+            yield sse_event('query_error', {'error': '查询不能为空'})
+            return
+        # 先发一条事件，让前端立即得到反馈
+        yield sse_event('status', {'message': '已收到查询，正在连接MCP服务...'})
+        client = init_mcp_client()
+        if client is None:
+            yield sse_event('query_error', {'error': 'Failed to initialize MCP client'})
+            return
+
+        events = queue.Queue()
+        future = asyncio.run_coroutine_threadsafe(
+            client.process_query(query, on_event=lambda event, data: events.put((event, data))),
+            task_runner.loop)
+        future.add_done_callback(lambda f: events.put(None))
+
+        while True:
+            try:
+                item = events.get(timeout=15)
+            except queue.Empty:
+                # 心跳，防止长时间无事件时连接被代理断开
+                yield ": keepalive\n\n"
+                continue
+            if item is None:
+                break
+            yield sse_event(*item)
+
+        if future.cancelled():
+            yield sse_event('query_error', {'error': '查询已取消'})
+        elif future.exception():
+            logger.error(f"Error processing streamed query: {future.exception()}")
+            yield sse_event('query_error', {'error': str(future.exception())})
+
+    return Response(generate(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/send_email', methods=['POST'])
 def send_email():
     if request.method == 'POST':
@@ -141,13 +261,40 @@ def upload_file():
         return redirect(request.url)
         
     if file and allowed_file(file.filename):
-        filename = secure_filename(file.filename)
+        # secure_filename会去掉中文等非ASCII字符（"评论.csv"变成"csv"），扩展名单独取出校验后再拼接，
+        # 并加上随机后缀避免同名上传互相覆盖
+        stem, ext = file.filename.rsplit('.', 1)
+        stem = secure_filename(stem)
+        unique = f"{stem}_{uuid.uuid4().hex[:8]}" if stem else uuid.uuid4().hex
+        filename = f"{unique}.{ext.lower()}"
         filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
         file.save(filepath)
         return jsonify({'success': True, 'file_path': filepath})
     else:
         return jsonify({'success': False, 'error': '不支持的文件类型'})
 
+@app.route('/ingest', methods=['POST'])
+def ingest():
+    file_path = request.form.get('file_path', '')
+    upload_dir = os.path.abspath(app.config['UPLOAD_FOLDER'])
+    full_path = os.path.abspath(file_path)
+    # 只允许分析上传目录中的文件
+    if os.path.dirname(full_path) != upload_dir or not os.path.isfile(full_path):
+        return jsonify({'success': False, 'error': '文件不存在'})
+    if full_path.rsplit('.', 1)[-1].lower() not in INGEST_EXTENSIONS:
+        return jsonify({'success': False, 'error': '仅支持txt、csv、jsonl评论文件'})
+
+    job_id = start_ingest_job(full_path)
+    logger.info(f"Ingest job {job_id} started for {full_path}")
+    return jsonify({'success': True, 'job_id': job_id})
+
+@app.route('/ingest_status/<job_id>')
+def ingest_status(job_id):
+    job = load_ingest_job(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': '任务不存在'})
+    return jsonify({'success': True, 'job': job})
+
 @app.route('/list_files')
 def list_files():
     output_dir = './llm_outputs'
@@ -183,6 +330,10 @@ def view_file(filename):
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
+@app.route('/rate_limit_metrics')
+def rate_limit_metrics():
+    return jsonify({'success': True, 'metrics': get_limiter().metrics()})
+
 @app.route('/stop_server')
 def stop_server():
     global mcp_client
@@ -0,0 +1,245 @@
+import io
+import os
+import re
+import csv
+import json
+import uuid
+import asyncio
+import logging
+from datetime import datetime
+from typing import Callable, Iterator, Optional
+from model_router import get_router
+
+logger = logging.getLogger("ingest")
+
+# 支持流式读取的文件类型
+INGEST_EXTENSIONS = {"txt", "csv", "jsonl"}
+# CSV/JSONL中依次尝试的文本字段名
+TEXT_FIELDS = ("comment", "text", "content", "评论", "内容")
+SENTIMENT_LABELS = ("正面", "中性", "负面")
+
+BATCH_SIZE = 20
+CONCURRENCY = 4
+RESULT_DIR = "./ingest_results"
+SUMMARY_DIR = "./llm_outputs"
+
+
+class _CountingFile(io.FileIO):
+    """在二进制层累计已读取的字节数，用于计算进度"""
+
+    def __init__(self, path: str, progress: dict):
+        super().__init__(path, "rb")
+        self._progress = progress
+
+    def readinto(self, buffer):
+        n = super().readinto(buffer)
+        if n:
+            self._progress["bytes_read"] += n
+        return n
+
+
+def _open_text(path: str, progress: dict) -> io.TextIOWrapper:
+    """以流式文本方式打开文件；newline=''保留原始换行，CSV引号内的多行字段才能正确解析"""
+    return io.TextIOWrapper(io.BufferedReader(_CountingFile(path, progress)),
+                            encoding="utf-8-sig", errors="replace", newline="")
+
+
+def _pick_text(record: dict) -> str:
+    for field in TEXT_FIELDS:
+        value = record.get(field)
+        if value:
+            return str(value)
+    return ""
+
+
+def iter_comments(path: str, progress: dict) -> Iterator[str]:
+    """逐条产出评论文本，不把整个文件载入内存"""
+    ext = path.rsplit(".", 1)[-1].lower()
+    with _open_text(path, progress) as f:
+        if ext == "csv":
+            yield from _iter_csv(f)
+            return
+        for line in f:
+            line = line.rstrip("\r\n")
+            if not line.strip():
+                continue
+            if ext == "jsonl":
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning(f"跳过无法解析的JSONL行: {line[:50]}")
+                    continue
+                line = _pick_text(record) if isinstance(record, dict) else str(record)
+                if not line.strip():
+                    continue
+            yield line.strip()
+
+
+def _iter_csv(f) -> Iterator[str]:
+    reader = csv.reader(f)
+    header = next(reader, None)
+    if header is None:
+        return
+    header = [h.strip() for h in header]
+    # 有已知文本列时按列名取值，否则把首行也当数据、取第一列
+    column = next((header.index(field) for field in TEXT_FIELDS if field in header), None)
+    if column is None:
+        column = 0
+        if header and header[0]:
+            yield header[0]
+    for row in reader:
+        if len(row) > column and row[column].strip():
+            yield row[column].strip()
+
+
+def classify_batch(texts: list, priority: str = "batch") -> list:
+    """一次LLM调用对一批评论做三分类，返回与输入等长的标签列表"""
+    numbered = "\n".join(f"{i + 1}. {text}" for i, text in enumerate(texts))
+    prompt = ("请判断以下每条评论的情感倾向，只能是“正面”、“中性”、“负面”之一。\n"
+              f"返回格式：JSON数组，按顺序只包含标签，共{len(texts)}项。\n\n{numbered}")
+    response = get_router().chat(
+        "sentiment",
+        [
+            {"role": "system", "content": "你是一个情感分析助手。"},
+            {"role": "user", "content": prompt}
+        ],
+        input_text=numbered,
+        priority=priority
+    )
+    content = response.choices[0].message.content.strip()
+    match = re.search(r"\[[\s\S]*\]", content)
+    try:
+        labels = json.loads(match.group(0)) if match else []
+    except json.JSONDecodeError:
+        labels = []
+    labels = [label if label in SENTIMENT_LABELS else "未知" for label in labels]
+    if len(labels) != len(texts):
+        logger.warning(f"标签数量({len(labels)})与评论数量({len(texts)})不一致")
+        labels = (labels + ["未知"] * len(texts))[:len(texts)]
+    return labels
+
+
+async def ingest_file(path: str, batch_size: int = BATCH_SIZE, concurrency: int = CONCURRENCY,
+                      on_progress: Optional[Callable[[dict], None]] = None,
+                      job_id: Optional[str] = None) -> dict:
+    """流式分析上传的评论文件
+
+    按行读取并分批，最多concurrency个批次同时在途；每批结果完成即追加写入JSONL，
+    内存占用与文件大小无关。结束后生成一份Markdown汇总报告。
+    job_id会写进结果和报告的文件名，同一文件的多个任务不会互相覆盖。
+    """
+    total_bytes = os.path.getsize(path)
+    progress = {
+        "bytes_read": 0,
+        "total_bytes": total_bytes,
+        "rows_done": 0,
+        "batches_done": 0,
+        "failed_batches": 0,
+        "counts": {label: 0 for label in SENTIMENT_LABELS + ("未知",)},
+    }
+
+    os.makedirs(RESULT_DIR, exist_ok=True)
+    base_name = os.path.splitext(os.path.basename(path))[0]
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    job_id = job_id or uuid.uuid4().hex
+    result_path = os.path.join(RESULT_DIR, f"{base_name}_{timestamp}_{job_id}.jsonl")
+
+    # 有界队列：读取速度受在途批次数约束，避免把整个文件读进内存
+    queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+
+    def report():
+        if not on_progress:
+            return
+        # 进度回调出错不影响分析本身
+        try:
+            on_progress(dict(progress, counts=dict(progress["counts"])))
+        except Exception as e:
+            logger.warning(f"进度回调失败: {e}")
+
+    async def process(out, start_line: int, texts: list):
+        try:
+            labels = await asyncio.to_thread(classify_batch, texts)
+        except Exception as e:
+            logger.error(f"批次(起始第{start_line}条)分析失败: {e}")
+            progress["failed_batches"] += 1
+            labels = ["未知"] * len(texts)
+        for offset, (text, label) in enumerate(zip(texts, labels)):
+            out.write(json.dumps({"index": start_line + offset, "text": text, "label": label},
+                                 ensure_ascii=False) + "\n")
+            progress["counts"][label] += 1
+        out.flush()
+        progress["rows_done"] += len(texts)
+        progress["batches_done"] += 1
+        report()
+
+    async def worker(out):
+        # 单个批次的任何异常（如写文件失败）都只影响该批次，worker继续消费队列，
+        # 否则worker全部退出后生产者会永远阻塞在queue.put上
+        while True:
+            item = await queue.get()
+            try:
+                if item is None:
+                    return
+                await process(out, *item)
+            except Exception as e:
+                logger.error(f"批次(起始第{item[0]}条)处理失败: {e}", exc_info=True)
+                progress["failed_batches"] += 1
+            finally:
+                queue.task_done()
+
+    with open(result_path, "w", encoding="utf-8") as out:
+        workers = [asyncio.create_task(worker(out)) for _ in range(concurrency)]
+        try:
+            batch, index = [], 0
+            for text in iter_comments(path, progress):
+                batch.append(text)
+                if len(batch) >= batch_size:
+                    await queue.put((index, batch))
+                    index += len(batch)
+                    batch = []
+            if batch:
+                await queue.put((index, batch))
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        except BaseException:
+            for task in workers:
+                task.cancel()
+            raise
+
+    summary_path = _write_summary(path, result_path, progress)
+    progress["result_path"] = result_path
+    progress["summary_path"] = summary_path
+    report()
+    logger.info(f"文件 {path} 分析完成，共 {progress['rows_done']} 条，结果保存到 {result_path}")
+    return progress
+
+
+def _write_summary(source_path: str, result_path: str, progress: dict) -> str:
+    total = progress["rows_done"] or 1
+    rows = "\n".join(
+        f"| {label} | {count} | {count / total:.1%} |" for label, count in progress["counts"].items()
+    )
+    markdown = f""" # 评论文件情感分析报告
+
+{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
+
+---
+## 数据来源
+{os.path.basename(source_path)}，共 {progress['rows_done']} 条评论
+
+---
+## 情感分布
+| 情感 | 数量 | 占比 |
+| --- | --- | --- |
+{rows}
+
+逐条结果：{result_path}
+"""
+    os.makedirs(SUMMARY_DIR, exist_ok=True)
+    # 汇总报告与逐条结果同名，同样不会在并发任务间冲突
+    result_name = os.path.splitext(os.path.basename(result_path))[0]
+    summary_path = os.path.join(SUMMARY_DIR, f"ingest_{result_name}.md")
+    with open(summary_path, "w", encoding="utf-8") as f:
+        f.write(markdown)
+    return summary_path
@@ -0,0 +1,222 @@
+import os
+import time
+import random
+import threading
+import logging
+from typing import Optional
+from openai import OpenAI
+from dotenv import load_dotenv
+from rate_limiter import estimate_tokens, get_limiter
+
+logger = logging.getLogger("model_router")
+
+load_dotenv()
+
+# 各调用点的路由策略：
+#   fast          优先使用快速模型，失败时回退到主模型
+#   fast_if_short 输入较短时优先快速模型，否则只用主模型
+#   full          只使用主模型
+ROUTE_POLICY = {
+    "plan": "fast",
+    "sentiment": "fast_if_short",
+    "summary": "full",
+}
+
+# 短文本阈值（字符数），可通过环境变量覆盖
+SHORT_TEXT_CHARS = int(os.getenv("SHORT_TEXT_CHARS", 2000))
+
+# 滑动平均系数、健康判定阈值
+EWMA_ALPHA = 0.2
+MAX_ERROR_RATE = 0.5
+MIN_SAMPLES = 3
+UNHEALTHY_COOLDOWN = 60  # 不健康端点冷却时间（秒）
+EXPLORE_RATE = 0.05  # 小概率探测非最优端点，保证延迟统计不过期
+
+
+def _prompt_tokens(messages: list) -> int:
+    return estimate_tokens("".join(str(m.get("content") or "") for m in messages)) or 1
+
+
+class ModelEndpoint:
+    """一个模型端点（模型名 + BASE_URL + API密钥）及其延迟、错误率统计"""
+
+    def __init__(self, name: str, model: str, base_url: str, api_key: str, tier: str = "full"):
+        self.name = name
+        self.model = model
+        self.base_url = base_url
+        self.tier = tier
+        self.client = OpenAI(base_url=base_url, api_key=api_key, timeout=60)
+        self.latency = {}  # 各调用点的滑动平均延迟（秒），缺少某调用点表示尚无样本
+        self.error_rate = 0.0
+        self.samples = 0
+        self.last_error_at = 0.0
+
+    def record(self, call_site: str, latency: float, ok: bool):
+        # 不同调用点的输入输出长度差异很大，延迟按调用点分别统计；错误率反映端点整体健康，共用一份
+        self.samples += 1
+        if ok:
+            previous = self.latency.get(call_site)
+            self.latency[call_site] = latency if previous is None else (
+                EWMA_ALPHA * latency + (1 - EWMA_ALPHA) * previous)
+        else:
+            self.last_error_at = time.monotonic()
+        self.error_rate = EWMA_ALPHA * (0.0 if ok else 1.0) + (1 - EWMA_ALPHA) * self.error_rate
+
+    def is_healthy(self) -> bool:
+        if self.samples < MIN_SAMPLES or self.error_rate <= MAX_ERROR_RATE:
+            return True
+        # 冷却期过后重新放行，让端点有机会恢复
+        return time.monotonic() - self.last_error_at > UNHEALTHY_COOLDOWN
+
+    def stats(self) -> dict:
+        return {
+            "name": self.name,
+            "model": self.model,
+            "tier": self.tier,
+            "latency": {site: round(value, 3) for site, value in self.latency.items()},
+            "error_rate": round(self.error_rate, 3),
+            "samples": self.samples,
+            "healthy": self.is_healthy(),
+        }
+
+
+class ModelRouter:
+    """按调用点和输入长度选择模型端点，并把流量转移到最快的健康端点"""
+
+    def __init__(self, endpoints: list):
+        if not endpoints:
+            raise ValueError("ModelRouter requires at least one endpoint.")
+        self.endpoints = endpoints
+        self._lock = threading.Lock()
+
+    def candidates(self, call_site: str, input_text: Optional[str] = None,
+                   stat_site: Optional[str] = None) -> list:
+        """返回按优先级排序的候选端点列表；stat_site指定排序所用的延迟统计，缺省为call_site"""
+        stat_site = stat_site or call_site
+        policy = ROUTE_POLICY.get(call_site, "full")
+        if policy == "fast_if_short":
+            policy = "fast" if input_text is not None and len(input_text) <= SHORT_TEXT_CHARS else "full"
+
+        full = [ep for ep in self.endpoints if ep.tier == "full"]
+        fast = [ep for ep in self.endpoints if ep.tier == "fast"]
+        with self._lock:
+            if policy == "fast":
+                groups = [self._rank(fast, stat_site), self._rank(full, stat_site)]
+            else:
+                groups = [self._rank(full, stat_site)]
+            ordered = [ep for group in groups for ep in group]
+            return ordered or self._rank(self.endpoints, stat_site)
+
+    def _rank(self, endpoints: list, call_site: str) -> list:
+        """按端点在该调用点上的延迟排序"""
+        healthy = [ep for ep in endpoints if ep.is_healthy()]
+        unhealthy = [ep for ep in endpoints if not ep.is_healthy()]
+        # 在该调用点尚无样本的端点排在最前，先测一次延迟
+        healthy.sort(key=lambda ep: ep.latency.get(call_site, -1.0))
+        if len(healthy) > 1 and random.random() < EXPLORE_RATE:
+            healthy.insert(0, healthy.pop(random.randrange(1, len(healthy))))
+        return healthy + unhealthy
+
+    def _record(self, endpoint: ModelEndpoint, call_site: str, started: float, ok: bool):
+        with self._lock:
+            endpoint.record(call_site, time.monotonic() - started, ok)
+
+    def chat(self, call_site: str, messages: list, input_text: Optional[str] = None,
+             priority: str = "interactive", **kwargs):
+        """调用chat.completions.create，失败时依次回退到下一个候选端点
+
+        每次请求前先从跨进程限流器取令牌，priority为batch的请求让位于交互式请求。
+        调用和限流等待都是阻塞的，异步代码中应通过asyncio.to_thread调用。
+        """
+        last_error = None
+        for endpoint in self.candidates(call_site, input_text):
+            get_limiter().acquire_sync("llm", _prompt_tokens(messages), priority)
+            started = time.monotonic()
+            try:
+                response = endpoint.client.chat.completions.create(
+                    model=endpoint.model, messages=messages, **kwargs)
+            except Exception as e:
+                self._record(endpoint, call_site, started, ok=False)
+                logger.warning(f"[{call_site}] 端点 {endpoint.name}({endpoint.model}) 调用失败: {e}")
+                last_error = e
+                continue
+            self._record(endpoint, call_site, started, ok=True)
+            logger.info(f"[{call_site}] 使用端点 {endpoint.name}({endpoint.model})，"
+                        f"耗时 {time.monotonic() - started:.2f}s")
+            return response
+        raise last_error
+
+    def chat_stream(self, call_site: str, messages: list, input_text: Optional[str] = None,
+                    priority: str = "interactive", **kwargs):
+        """流式调用，逐段产出文本增量；只在收到首个增量前回退到下一个端点
+
+        流式请求记录整段输出的总耗时，并单独统计在"<call_site>:stream"下，不与非流式请求的延迟混在一起。
+        """
+        stat_site = f"{call_site}:stream"
+        last_error = None
+        for endpoint in self.candidates(call_site, input_text, stat_site):
+            get_limiter().acquire_sync("llm", _prompt_tokens(messages), priority)
+            started = time.monotonic()
+            emitted = False
+            try:
+                stream = endpoint.client.chat.completions.create(
+                    model=endpoint.model, messages=messages, stream=True, **kwargs)
+                for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        emitted = True
+                        yield delta
+            except Exception as e:
+                self._record(endpoint, stat_site, started, ok=False)
+                if emitted:
+                    raise
+                logger.warning(f"[{call_site}] 端点 {endpoint.name}({endpoint.model}) 流式调用失败: {e}")
+                last_error = e
+                continue
+            self._record(endpoint, stat_site, started, ok=True)
+            return
+        raise last_error
+
+    def stats(self) -> list:
+        with self._lock:
+            return [ep.stats() for ep in self.endpoints]
+
+
+def load_endpoints_from_env() -> list:
+    """从环境变量构造端点列表
+
+    主模型：QWEN_API_KEY / BASE_URL / MODEL
+    快速模型：FAST_MODELS（逗号分隔），可选 FAST_BASE_URL / FAST_API_KEY，缺省沿用主模型配置
+    其他主力模型：EXTRA_MODELS（逗号分隔），与主模型共用 BASE_URL / QWEN_API_KEY
+    """
+    api_key = os.getenv("QWEN_API_KEY")
+    base_url = os.getenv("BASE_URL")
+    model = os.getenv("MODEL")
+    if not api_key:
+        raise ValueError("QWEN_API_KEY environment variable is not set.")
+
+    endpoints = [ModelEndpoint("default", model, base_url, api_key, tier="full")]
+    for extra in filter(None, (m.strip() for m in os.getenv("EXTRA_MODELS", "").split(","))):
+        endpoints.append(ModelEndpoint(f"extra:{extra}", extra, base_url, api_key, tier="full"))
+
+    fast_base_url = os.getenv("FAST_BASE_URL", base_url)
+    fast_api_key = os.getenv("FAST_API_KEY", api_key)
+    for fast in filter(None, (m.strip() for m in os.getenv("FAST_MODELS", "").split(","))):
+        endpoints.append(ModelEndpoint(f"fast:{fast}", fast, fast_base_url, fast_api_key, tier="fast"))
+    return endpoints
+
+
+_router: Optional[ModelRouter] = None
+_router_lock = threading.Lock()
+
+
+def get_router() -> ModelRouter:
+    """获取进程内共享的路由器实例"""
+    global _router
+    with _router_lock:
+        if _router is None:
+            _router = ModelRouter(load_endpoints_from_env())
+            logger.info(f"Model router initialized: {[ep.name for ep in _router.endpoints]}")
+        return _router
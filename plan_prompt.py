@@ -0,0 +1,58 @@
+import json
+
+# JSON Schema类型到紧凑写法的映射
+TYPE_NAMES = {
+    "string": "str",
+    "integer": "int",
+    "number": "float",
+    "boolean": "bool",
+    "array": "list",
+    "object": "dict",
+}
+
+PLAN_INSTRUCTIONS = ("请根据用户的查询计划使用这些工具。"
+                     "如果多个工具需要串联，后续步骤中可以使用{{上一步工具名}}占位。\n"
+                     "返回格式：JSON数组，每个对象包含name和arguments字段")
+
+
+def compact_tool_line(tool) -> str:
+    """把MCP工具压缩成一行：name(必填参数:类型, 可选参数?:类型): 描述首行"""
+    schema = tool.inputSchema or {}
+    required = set(schema.get("required", []))
+    args = ", ".join(
+        f"{name}{'' if name in required else '?'}:{TYPE_NAMES.get(prop.get('type'), prop.get('type', 'any'))}"
+        for name, prop in schema.get("properties", {}).items()
+    )
+    description = next((line.strip() for line in (tool.description or "").splitlines() if line.strip()), "")
+    return f"{tool.name}({args}): {description}"
+
+
+def build_plan_prompt(tools: list) -> str:
+    """构造规划用的系统提示
+
+    工具按名称排序、内容只依赖工具列表，同一会话内每次查询的前缀逐字节相同，
+    可以命中服务商侧的提示缓存；随查询变化的内容全部放在用户消息中。
+    """
+    tool_list_text = "\n".join(compact_tool_line(tool) for tool in sorted(tools, key=lambda t: t.name))
+    return ("你是一个智能助手，用户会给出一句请求。以下是可用的工具列表（请严格使用工具名称）：\n"
+            f"{tool_list_text}\n"
+            f"{PLAN_INSTRUCTIONS}")
+
+
+def build_legacy_prompt(tools: list) -> str:
+    """旧格式的规划输入（逐条工具描述 + 完整tools参数JSON），仅用于估算节省的token"""
+    tool_list_text = "\n".join(f"{tool.name}: {tool.description}" for tool in tools)
+    tool_schemas = [
+        {
+            "type": "function",
+            "function": {
+                "name": tool.name,
+                "description": tool.description,
+                "input_schema": tool.inputSchema
+            }
+        } for tool in tools
+    ]
+    return ("你是一个智能助手，用户会给出一句请求。以下是可用的工具列表（请严格使用工具名称）：\n"
+            f"{tool_list_text}\n"
+            f"{PLAN_INSTRUCTIONS}"
+            f"{json.dumps(tool_schemas, ensure_ascii=False)}")
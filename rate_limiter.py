@@ -0,0 +1,178 @@
+import os
+import re
+import time
+import random
+import sqlite3
+import asyncio
+import logging
+import threading
+from typing import Optional
+from dotenv import load_dotenv
+
+logger = logging.getLogger("rate_limiter")
+
+load_dotenv()
+
+# 每个提供方的配额：rpm为每分钟请求数，tpm为每分钟token数（None表示不限制）
+LIMITS = {
+    "llm": {
+        "rpm": int(os.getenv("LLM_RPM", 60)),
+        "tpm": int(os.getenv("LLM_TPM", 100000)),
+    },
+    "serpapi": {
+        "rpm": int(os.getenv("SERPAPI_RPM", 30)),
+        "tpm": None,
+    },
+}
+
+# 批处理请求只能使用桶中超出该比例的部分，剩余容量留给交互式请求
+BATCH_RESERVE_RATIO = 0.2
+PRIORITIES = ("interactive", "batch")
+# 所有进程必须使用同一个数据库文件，相对路径按本模块所在目录解析，与各进程的工作目录无关
+DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                       os.getenv("RATE_LIMIT_DB", "rate_limits.sqlite"))
+
+
+class RateLimiter:
+    """基于SQLite的跨进程令牌桶限流器
+
+    同一主机上的所有server.py / Flask进程共享同一个数据库文件，
+    每次取令牌都在BEGIN IMMEDIATE事务中完成，保证多进程下的一致性。
+    """
+
+    def __init__(self, db_path: str = DB_PATH, limits: Optional[dict] = None):
+        self.db_path = db_path
+        self.limits = limits or LIMITS
+        self._init_db()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=10, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def _init_db(self):
+        conn = self._connect()
+        try:
+            conn.execute("""CREATE TABLE IF NOT EXISTS buckets (
+                provider TEXT, kind TEXT, level REAL, updated REAL,
+                PRIMARY KEY (provider, kind))""")
+            conn.execute("""CREATE TABLE IF NOT EXISTS metrics (
+                provider TEXT, priority TEXT, requests INTEGER, throttled INTEGER, wait_seconds REAL,
+                PRIMARY KEY (provider, priority))""")
+        finally:
+            conn.close()
+
+    def _try_acquire(self, provider: str, tokens: int, priority: str) -> float:
+        """尝试取令牌：成功返回0，否则返回建议等待的秒数"""
+        limits = self.limits.get(provider)
+        if not limits:
+            return 0.0
+        costs = {"rpm": 1, "tpm": tokens}
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            levels, wait = {}, 0.0
+            for kind, capacity in limits.items():
+                if not capacity:
+                    continue
+                row = conn.execute("SELECT level, updated FROM buckets WHERE provider=? AND kind=?",
+                                   (provider, kind)).fetchone()
+                rate = capacity / 60.0
+                level = capacity if row is None else min(capacity, row[0] + (now - row[1]) * rate)
+                reserve = capacity * BATCH_RESERVE_RATIO if priority == "batch" else 0.0
+                # 单次消耗超过可用容量（批处理需扣除预留部分）时按可用容量计，避免永远等不到
+                cost = min(costs[kind], capacity - reserve)
+                if level - cost < reserve:
+                    wait = max(wait, (cost + reserve - level) / rate)
+                levels[kind] = (level, cost)
+            if wait > 0:
+                conn.execute("ROLLBACK")
+                return wait
+            for kind, (level, cost) in levels.items():
+                conn.execute("INSERT OR REPLACE INTO buckets (provider, kind, level, updated) VALUES (?, ?, ?, ?)",
+                             (provider, kind, level - cost, now))
+            conn.execute("COMMIT")
+            return 0.0
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def _record(self, provider: str, priority: str, waited: float):
+        conn = self._connect()
+        try:
+            conn.execute("""INSERT INTO metrics (provider, priority, requests, throttled, wait_seconds)
+                VALUES (?, ?, 1, ?, ?)
+                ON CONFLICT (provider, priority) DO UPDATE SET
+                    requests = requests + 1,
+                    throttled = throttled + excluded.throttled,
+                    wait_seconds = wait_seconds + excluded.wait_seconds""",
+                         (provider, priority, 1 if waited > 0 else 0, waited))
+        finally:
+            conn.close()
+        if waited > 0:
+            logger.info(f"[{provider}/{priority}] 限流等待 {waited:.2f}s")
+
+    @staticmethod
+    def _sleep_time(wait: float, priority: str) -> float:
+        # 批处理请求轮询得更慢一些，并加随机抖动，避免多进程同时醒来争抢
+        ceiling = 1.0 if priority == "interactive" else 2.0
+        return min(wait, ceiling) * random.uniform(1.0, 1.2)
+
+    def acquire_sync(self, provider: str, tokens: int = 1, priority: str = "interactive"):
+        """阻塞直到取得令牌，供同步调用点使用"""
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority: {priority}")
+        waited = 0.0
+        while (wait := self._try_acquire(provider, tokens, priority)) > 0:
+            delay = self._sleep_time(wait, priority)
+            time.sleep(delay)
+            waited += delay
+        self._record(provider, priority, waited)
+
+    async def acquire(self, provider: str, tokens: int = 1, priority: str = "interactive"):
+        """异步等待直到取得令牌，等待期间不阻塞事件循环"""
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority: {priority}")
+        waited = 0.0
+        while (wait := await asyncio.to_thread(self._try_acquire, provider, tokens, priority)) > 0:
+            delay = self._sleep_time(wait, priority)
+            await asyncio.sleep(delay)
+            waited += delay
+        await asyncio.to_thread(self._record, provider, priority, waited)
+
+    def metrics(self) -> list:
+        """返回各提供方、各优先级的请求数、被限流次数和累计等待时间"""
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT provider, priority, requests, throttled, wait_seconds FROM metrics ORDER BY provider, priority"
+            ).fetchall()
+        finally:
+            conn.close()
+        return [
+            {"provider": p, "priority": pr, "requests": r, "throttled": t, "wait_seconds": round(w, 3)}
+            for p, pr, r, t, w in rows
+        ]
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算token数：中日韩字符约1字1token，其余约4字符1token"""
+    cjk = len(re.findall(r"[\u3000-\u9fff\uff00-\uffef]", text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+_limiter: Optional[RateLimiter] = None
+_limiter_lock = threading.Lock()
+
+
+def get_limiter() -> RateLimiter:
+    """获取进程内共享的限流器实例"""
+    global _limiter
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = RateLimiter()
+        return _limiter
@@ -0,0 +1,41 @@
+import os
+from typing import Optional
+
+# 已知的纯动作型计划形态（按执行顺序的工具名），最终回复只需告知执行结果，可直接用模板渲染，
+# 省去一次总结LLM调用；以搜索或分析结果作答的开放式查询不在此列，仍由LLM总结
+KNOWN_PLAN_SHAPES = {
+    ("analyze_sentiment",),
+    ("send_email_with_attachment",),
+    ("watch_topic",),
+    ("analyze_sentiment", "send_email_with_attachment"),
+    ("search_google", "analyze_sentiment", "send_email_with_attachment"),
+}
+
+# 每个工具输出对应的回复片段
+TOOL_TEMPLATES = {
+    "search_google": "已完成相关新闻搜索。",
+    "analyze_sentiment": "情感分析报告已生成，保存在：{output}",
+    "send_email_with_attachment": "{output}",
+    "watch_topic": "{output}",
+}
+
+
+def fast_path_enabled() -> bool:
+    """是否启用模板快速回复，可通过环境变量FAST_PATH_RESPONSE=0关闭"""
+    return os.getenv("FAST_PATH_RESPONSE", "1").lower() not in ("0", "false", "no")
+
+
+def render_fast_response(tool_plan: list, tool_outputs: dict, failed_tools: set = frozenset()) -> Optional[str]:
+    """按模板渲染已知计划形态的最终回复
+
+    开放式查询或任一工具执行失败时返回None，由LLM根据工具输出总结。
+    """
+    shape = tuple(tool.get("name") for tool in tool_plan)
+    if shape not in KNOWN_PLAN_SHAPES:
+        return None
+    if failed_tools or any(name not in tool_outputs for name in shape):
+        return None
+
+    return "\n\n".join(
+        TOOL_TEMPLATES[name].format(output=tool_outputs[name].strip()) for name in shape
+    )
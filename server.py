@@ -1,26 +1,44 @@
 import os
-from openai import OpenAI
 from mcp.server.fastmcp import FastMCP
 from datetime import datetime
 from dotenv import load_dotenv
+from model_router import get_router
+from rate_limiter import get_limiter
+from topic_watch import format_summary, refresh_topic
 import json
 import httpx
+import asyncio
 import smtplib
+import argparse
 import os
 from email.message import EmailMessage
 
 load_dotenv()
 
-#初始化mcp服务器
-mcp = FastMCP("mcp-server")
 
-@mcp.tool()
-async def search_google(query: str) -> str:
-    """使用Google搜索"""
-    #这里可以调用Google API进行搜索
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="MCP server")
+    parser.add_argument("--transport", choices=["stdio", "sse", "streamable-http"],
+                        default=os.getenv("MCP_TRANSPORT", "stdio"),
+                        help="stdio供单个客户端子进程使用；sse/streamable-http可被多个客户端共享")
+    parser.add_argument("--host", default=os.getenv("MCP_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("MCP_PORT", 8000)))
+    return parser.parse_args(argv)
+
+
+# 直接运行时解析命令行参数，被topic_watch等模块导入时只使用环境变量中的默认值
+server_args = parse_args() if __name__ == "__main__" else parse_args([])
+
+#初始化mcp服务器：host/port必须在构造时传入，FastMCP据此决定是否只允许localhost访问（DNS重绑定保护），
+#构造后再修改settings.host不会放开限制，--host 0.0.0.0时其他机器上的worker会被拒绝
+mcp = FastMCP("mcp-server", host=server_args.host, port=server_args.port)
+
+async def fetch_news(query: str, limit: int = 5, priority: str = "interactive") -> list:
+    """调用SerpAPI获取新闻列表，返回包含title/link/snippet/date的字典列表"""
     api_key = os.getenv("GOOGLE_API_KEY")
     if not api_key:
         raise ValueError("GOOGLE_API_KEY environment variable is not set.") 
+    await get_limiter().acquire("serpapi", priority=priority)
     url = "https://serpapi.com/search?engine=google_news"
     headers = {
         "X-API-KEY": api_key,
@@ -31,16 +49,31 @@ async def search_google(query: str) -> str:
     async with httpx.AsyncClient() as client:
         response = await client.post(url, headers=headers, json=payload)
         data = response.json()
-    
-    if "news" not in data:
-        return "没有找到相关的新闻。"
 
-    articles = [
+    return [
         {
             "title": article.get("title"),
             "link": article.get("link"),
-            "snippet": article.get("snippet")
-        } for article in data["news"][:5]  # 获取前5条新闻
+            "snippet": article.get("snippet"),
+            "date": article.get("date")
+        } for article in data.get("news", [])[:limit]
+    ]
+
+
+@mcp.tool()
+async def search_google(query: str) -> str:
+    """使用Google搜索"""
+    #这里可以调用Google API进行搜索
+    news = await fetch_news(query, limit=5)  # 获取前5条新闻
+    if not news:
+        return "没有找到相关的新闻。"
+
+    articles = [
+        {
+            "title": article["title"],
+            "link": article["link"],
+            "snippet": article["snippet"]
+        } for article in news
     ]
 
     output_dir = "./google_news"
@@ -63,20 +96,17 @@ async def search_google(query: str) -> str:
 async def analyze_sentiment(text: str) -> str:
     """分析文本情感"""
     #这里可以调用情感分析API
-    api_key = os.getenv("QWEN_API_KEY")
-    model = os.getenv("MODEL")
-    client = OpenAI(
-        api_key=api_key,
-        base_url=os.getenv("BASE_URL"),
-        model=model
-    )
+    #短文本优先路由到快速模型
     prompt = f"请分析以下文本的情感倾向，并说明原因：\n\n{text}"
-    response = client.chat.completions.create(
-        model=model,
-        messages=[
+    #LLM调用和限流等待会阻塞，放到线程中执行，避免卡住服务器的事件循环
+    response = await asyncio.to_thread(
+        get_router().chat,
+        "sentiment",
+        [
             {"role": "system", "content": "你是一个情感分析助手。"},
             {"role": "user", "content": prompt}
-        ]
+        ],
+        input_text=text
     )
     result =response.choices[0].message.content.strip()
 
@@ -105,6 +135,13 @@ async def analyze_sentiment(text: str) -> str:
 
 
 
+@mcp.tool()
+async def watch_topic(topic: str) -> str:
+    """增量刷新话题情感：只分析上次刷新后新出现的新闻，并更新累计情感统计"""
+    result = await refresh_topic(topic, fetch_news, priority="interactive")
+    return format_summary(result)
+
+
 @mcp.tool()
 async def send_email_with_attachment(to: str, subject: str, body: str, file_path: str) -> str:
     """发送带附件的电子邮件
@@ -170,15 +207,18 @@ async def send_email_with_attachment(to: str, subject: str, body: str, file_path
         return f"发送邮件失败：{str(e)}"
     
 
-import asyncio
-
 if __name__ == "__main__":
     print("Starting server...")
     try:
         # 直接运行异步函数
         async def run_server():
-            print("Server is running asynchronously...")
-            await mcp.run_stdio_async()
+            print(f"Server is running asynchronously with {server_args.transport} transport...")
+            if server_args.transport == "stdio":
+                await mcp.run_stdio_async()
+            elif server_args.transport == "sse":
+                await mcp.run_sse_async()
+            else:
+                await mcp.run_streamable_http_async()
             print("Server completed successfully")
 
         asyncio.run(run_server())
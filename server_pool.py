@@ -0,0 +1,46 @@
+import os
+import time
+import random
+import logging
+
+logger = logging.getLogger("server_pool")
+
+FAILURE_COOLDOWN = 30  # 连接失败的服务器在此时间内（秒）排到最后
+
+
+class ServerPool:
+    """MCP服务器URL池：客户端侧随机粘性分配与故障转移
+
+    每个进程随机选定一个起始服务器并在整个会话期间保持连接（MCP会话有状态），
+    多个Flask worker因此大致均匀地分散到各服务器上；只有连接失败时才按顺序切换到下一个，
+    最近失败的服务器在冷却期内排到最后。
+    """
+
+    def __init__(self, urls: list):
+        if not urls:
+            raise ValueError("ServerPool requires at least one server URL.")
+        self.urls = list(urls)
+        self._cursor = random.randrange(len(self.urls))
+        self._failed_at = {}
+
+    def order(self) -> list:
+        """返回本次连接（首次连接或故障转移）尝试的URL顺序"""
+        start = self._cursor
+        self._cursor = (self._cursor + 1) % len(self.urls)
+        rotated = self.urls[start:] + self.urls[:start]
+        now = time.monotonic()
+        healthy = [u for u in rotated if now - self._failed_at.get(u, float("-inf")) > FAILURE_COOLDOWN]
+        cooling = [u for u in rotated if u not in healthy]
+        return healthy + cooling
+
+    def mark_failed(self, url: str):
+        logger.warning(f"MCP server {url} marked as failed")
+        self._failed_at[url] = time.monotonic()
+
+    def mark_ok(self, url: str):
+        self._failed_at.pop(url, None)
+
+
+def server_urls_from_env() -> list:
+    """读取MCP_SERVER_URLS（逗号分隔），未配置时返回空列表"""
+    return [u.strip() for u in os.getenv("MCP_SERVER_URLS", "").split(",") if u.strip()]
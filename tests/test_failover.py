@@ -0,0 +1,148 @@
+"""服务器池故障转移测试：启动真实的streamable-HTTP MCP服务器，并包含一个无人监听的地址"""
+import sys
+import time
+import socket
+import asyncio
+import subprocess
+import pytest
+
+pytest.importorskip("mcp")
+pytest.importorskip("openai")
+pytest.importorskip("dotenv")
+
+# 最小的MCP服务器：whoami工具返回自己的端口，用来判断客户端连到了哪台服务器
+SERVER_SCRIPT = """
+import sys
+from mcp.server.fastmcp import FastMCP
+mcp = FastMCP("failover-test", host="127.0.0.1", port=int(sys.argv[1]), log_level="WARNING")
+
+@mcp.tool()
+def whoami() -> str:
+    return sys.argv[1]
+
+mcp.run(transport="streamable-http")
+"""
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_listening(port: int, proc: subprocess.Popen, timeout: float = 20):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"test server on port {port} exited with code {proc.returncode}")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.2).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"test server on port {port} did not start")
+
+
+@pytest.fixture
+def start_server(tmp_path):
+    script = tmp_path / "failover_server.py"
+    script.write_text(SERVER_SCRIPT, encoding="utf-8")
+    procs = []
+
+    def start() -> tuple:
+        port = _free_port()
+        proc = subprocess.Popen([sys.executable, str(script), str(port)],
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        procs.append(proc)
+        _wait_listening(port, proc)
+        return f"http://127.0.0.1:{port}/mcp", proc
+
+    yield start
+    for proc in procs:
+        proc.kill()
+        proc.wait()
+
+
+@pytest.fixture
+def client_module(tmp_path, monkeypatch):
+    # client.py在导入时创建client.log，切到临时目录避免写入仓库
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("QWEN_API_KEY", "test-key")
+    monkeypatch.setenv("BASE_URL", "http://127.0.0.1:9/v1")
+    monkeypatch.setenv("MODEL", "test-model")
+    return pytest.importorskip("client")
+
+
+async def _whoami(client, replay: bool = True) -> str:
+    result = await client._with_failover(lambda session: session.call_tool(name="whoami", arguments={}),
+                                         replay=replay)
+    return result.content[0].text
+
+
+def test_connect_skips_server_that_is_down(client_module, start_server):
+    live_url, _ = start_server()
+    dead_url = f"http://127.0.0.1:{_free_port()}/mcp"
+
+    async def scenario():
+        client = client_module.MCPClient()
+        try:
+            # 起始服务器随机选定，两种顺序都要能连上存活的服务器
+            for _ in range(4):
+                await client.connect_to_server([dead_url, live_url])
+                assert client.server_url == live_url
+                assert await _whoami(client) == live_url.split(":")[-1].split("/")[0]
+                await client.cleanup()
+        finally:
+            await client.cleanup()
+
+    asyncio.run(asyncio.wait_for(scenario(), 60))
+
+
+def test_fails_over_when_connected_server_dies(client_module, start_server):
+    servers = dict([start_server(), start_server()])
+
+    async def scenario():
+        client = client_module.MCPClient()
+        try:
+            await client.connect_to_server(list(servers))
+            first_url = client.server_url
+            servers[first_url].kill()
+            servers[first_url].wait()
+
+            # 可重发的操作在切换后自动重试
+            tools = await client._with_failover(lambda session: session.list_tools())
+            assert [tool.name for tool in tools.tools] == ["whoami"]
+            assert client.server_url != first_url
+
+            other_url = client.server_url
+            servers[other_url].kill()
+            servers[other_url].wait()
+            # 全部服务器都不可用时报错，而不是一直等待读超时
+            with pytest.raises(RuntimeError, match="All MCP servers are unavailable"):
+                await _whoami(client)
+        finally:
+            await client.cleanup()
+
+    asyncio.run(asyncio.wait_for(scenario(), 60))
+
+
+def test_call_tool_is_not_replayed_after_failover(client_module, start_server):
+    servers = dict([start_server(), start_server()])
+
+    async def scenario():
+        client = client_module.MCPClient()
+        try:
+            await client.connect_to_server(list(servers))
+            first_url = client.server_url
+            servers[first_url].kill()
+            servers[first_url].wait()
+
+            with pytest.raises(client_module.ServerUnavailableError):
+                await _whoami(client, replay=False)
+            # 已切换到另一台服务器，后续调用正常
+            assert client.server_url != first_url
+            assert await _whoami(client, replay=False) == client.server_url.split(":")[-1].split("/")[0]
+        finally:
+            await client.cleanup()
+
+    asyncio.run(asyncio.wait_for(scenario(), 60))
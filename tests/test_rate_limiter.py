@@ -0,0 +1,69 @@
+"""令牌桶限流器的单元测试：批处理预留、单次消耗上限和按时间回填"""
+import os
+import time
+import pytest
+
+pytest.importorskip("dotenv")
+
+import rate_limiter
+from rate_limiter import RateLimiter
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """可手动推进的时钟，避免测试依赖真实时间"""
+    now = [1_000_000.0]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+    return now
+
+
+def make_limiter(tmp_path, rpm, tpm=None) -> RateLimiter:
+    return RateLimiter(db_path=str(tmp_path / "limits.sqlite"), limits={"llm": {"rpm": rpm, "tpm": tpm}})
+
+
+def drain(limiter, priority, tokens=1) -> int:
+    acquired = 0
+    while limiter._try_acquire("llm", tokens, priority) == 0:
+        acquired += 1
+    return acquired
+
+
+def test_batch_leaves_reserve_for_interactive(tmp_path, clock):
+    limiter = make_limiter(tmp_path, rpm=10)
+    # 批处理只能用到容量的80%，剩下的20%留给交互式请求
+    assert drain(limiter, "batch") == 8
+    assert drain(limiter, "interactive") == 2
+    assert limiter._try_acquire("llm", 1, "interactive") > 0
+
+
+def test_oversized_cost_is_capped_to_usable_capacity(tmp_path, clock):
+    limiter = make_limiter(tmp_path, rpm=100, tpm=1000)
+    # 批处理单次900 token超过可用的800，按800计，满桶时能直接取到
+    assert limiter._try_acquire("llm", 900, "batch") == 0
+    # 剩余200，全部是预留部分，批处理必须等待
+    assert limiter._try_acquire("llm", 900, "batch") > 0
+    # 交互式请求超过容量时按整个容量计，同样不会永远等不到
+    clock[0] += 60
+    assert limiter._try_acquire("llm", 5000, "interactive") == 0
+
+
+def test_bucket_refills_over_time(tmp_path, clock):
+    limiter = make_limiter(tmp_path, rpm=60)
+    assert drain(limiter, "interactive") == 60
+    # 每秒回填1个令牌，建议等待时间约为1秒
+    assert limiter._try_acquire("llm", 1, "interactive") == pytest.approx(1.0)
+    clock[0] += 1
+    assert limiter._try_acquire("llm", 1, "interactive") == 0
+    assert limiter._try_acquire("llm", 1, "interactive") > 0
+    # 回填不超过容量
+    clock[0] += 3600
+    assert drain(limiter, "interactive") == 60
+
+
+def test_unconfigured_provider_never_waits(tmp_path, clock):
+    limiter = make_limiter(tmp_path, rpm=1)
+    assert all(limiter._try_acquire("serpapi", 1, "batch") == 0 for _ in range(5))
+
+
+def test_default_db_path_does_not_depend_on_working_directory():
+    assert os.path.isabs(rate_limiter.DB_PATH)
@@ -0,0 +1,179 @@
+import os
+import re
+import json
+import uuid
+import hashlib
+import asyncio
+import logging
+import argparse
+from datetime import datetime
+from contextlib import asynccontextmanager
+from functools import partial
+from typing import Awaitable, Callable
+from ingest import SENTIMENT_LABELS, classify_batch
+
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
+
+logger = logging.getLogger("topic_watch")
+
+STATE_DIR = "./topic_watch"
+FETCH_LIMIT = 20  # 每次刷新拉取的新闻条数
+MAX_SEEN = 5000  # 水位线中保留的已见链接上限
+MAX_HISTORY = 200  # 保留的刷新记录条数
+LOCK_POLL_INTERVAL = 0.2  # 等待话题锁时的轮询间隔（秒）
+
+
+def _state_path(topic: str) -> str:
+    # 文件名带上话题的哈希，避免不同话题清理或截断后映射到同一文件
+    safe_topic = re.sub(r"[^\w]", "_", topic)[:40]
+    digest = hashlib.sha1(topic.encode("utf-8")).hexdigest()[:12]
+    return os.path.join(STATE_DIR, f"{safe_topic}_{digest}.json")
+
+
+def load_state(topic: str) -> dict:
+    """读取话题的水位线和累计情感统计，不存在时返回初始状态"""
+    path = _state_path(topic)
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return {
+        "topic": topic,
+        "seen_links": [],
+        "last_run": None,
+        "aggregate": {label: 0 for label in SENTIMENT_LABELS + ("未知",)},
+        "total": 0,
+        "history": [],
+    }
+
+
+def save_state(topic: str, state: dict):
+    """先写唯一的临时文件再替换，避免读到半截的状态文件"""
+    os.makedirs(STATE_DIR, exist_ok=True)
+    path = _state_path(topic)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _try_lock(f) -> bool:
+    try:
+        if os.name == "nt":
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except OSError:
+        return False
+
+
+def _unlock(f):
+    if os.name == "nt":
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+    else:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+@asynccontextmanager
+async def topic_lock(topic: str):
+    """跨进程的话题文件锁：CLI定时任务和服务器池中的多个server.py不会同时刷新同一话题"""
+    os.makedirs(STATE_DIR, exist_ok=True)
+    with open(f"{_state_path(topic)}.lock", "a+") as f:
+        while not _try_lock(f):
+            await asyncio.sleep(LOCK_POLL_INTERVAL)
+        try:
+            yield
+        finally:
+            _unlock(f)
+
+
+async def refresh_topic(topic: str, fetch: Callable[[str, int], Awaitable[list]],
+                        priority: str = "batch") -> dict:
+    """增量刷新一个话题
+
+    只分析水位线之后新出现的新闻，并把这批新增的情感计数累加到话题的累计统计中，
+    刷新成本与新增内容成正比，而不是与历史总量成正比。
+    """
+    # 读取、分析、保存在同一把锁内完成，避免并发刷新丢失更新或重复计数
+    async with topic_lock(topic):
+        return await _refresh_locked(topic, fetch, priority)
+
+
+async def _refresh_locked(topic: str, fetch: Callable[[str, int], Awaitable[list]], priority: str) -> dict:
+    state = load_state(topic)
+    seen = set(state["seen_links"])
+
+    articles = await fetch(topic, FETCH_LIMIT)
+    new_articles = [a for a in articles if a.get("link") and a["link"] not in seen]
+    delta = {label: 0 for label in state["aggregate"]}
+    labels = []
+
+    if new_articles:
+        texts = [f"{a.get('title') or ''} {a.get('snippet') or ''}".strip() for a in new_articles]
+        labels = await asyncio.to_thread(classify_batch, texts, priority)
+        for label in labels:
+            delta[label] += 1
+            state["aggregate"][label] += 1
+        state["total"] += len(new_articles)
+        state["seen_links"] = (state["seen_links"] + [a["link"] for a in new_articles])[-MAX_SEEN:]
+
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    state["last_run"] = now
+    state["history"] = (state["history"] + [{"time": now, "new": len(new_articles), "delta": delta}])[-MAX_HISTORY:]
+    save_state(topic, state)
+    logger.info(f"话题 {topic} 刷新完成：拉取 {len(articles)} 条，新增 {len(new_articles)} 条")
+
+    return {
+        "topic": topic,
+        "fetched": len(articles),
+        "new": len(new_articles),
+        "new_articles": [
+            {"title": a.get("title"), "link": a.get("link"), "label": label}
+            for a, label in zip(new_articles, labels)
+        ],
+        "delta": delta,
+        "aggregate": state["aggregate"],
+        "total": state["total"],
+        "last_run": now,
+    }
+
+
+def format_summary(result: dict) -> str:
+    """把刷新结果格式化为可读文本"""
+    total = result["total"] or 1
+    aggregate = "，".join(
+        f"{label} {count}（{count / total:.1%}）" for label, count in result["aggregate"].items() if count
+    )
+    lines = [f"话题「{result['topic']}」本次拉取 {result['fetched']} 条，新增 {result['new']} 条。"]
+    for article in result["new_articles"]:
+        lines.append(f"- [{article['label']}] {article['title']} {article['link']}")
+    lines.append(f"累计 {result['total']} 条：{aggregate or '暂无数据'}")
+    return "\n".join(lines)
+
+
+async def watch(topics: list, interval_minutes: float):
+    """按固定间隔循环刷新多个话题"""
+    from server import fetch_news
+
+    # 定时刷新属于批处理，搜索和LLM配额都让位于交互式请求
+    fetch = partial(fetch_news, priority="batch")
+    while True:
+        for topic in topics:
+            try:
+                result = await refresh_topic(topic, fetch)
+                print(format_summary(result))
+            except Exception as e:
+                logger.error(f"话题 {topic} 刷新失败: {e}", exc_info=True)
+        await asyncio.sleep(interval_minutes * 60)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="定时增量刷新话题情感")
+    parser.add_argument("topics", nargs="+", help="要监控的话题，例如：网友对小米su7的看法")
+    parser.add_argument("--interval", type=float, default=180, help="刷新间隔（分钟）")
+    args = parser.parse_args()
+    asyncio.run(watch(args.topics, args.interval))